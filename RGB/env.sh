@@ -9,4 +9,9 @@ pip install transformers_stream_generator
 pip install tiktoken
 pip install einops
 pip install fschat
-pip install nvgpu
\ No newline at end of file
+pip install nvgpu
+pip install httpx[http2]
+pip install orjson
+pip install aiolimiter
+pip install polars
+pip install tenacity
\ No newline at end of file
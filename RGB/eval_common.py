@@ -0,0 +1,956 @@
+"""
+Shared driver for the LLM-judged evaluations (reject_evalue.py, fact_evalue.py and joint_evalue.py).
+
+Each script describes its evaluation as a Task (prompts, batching and the local fast path); this module
+reads the prediction file, sends the pending records to the evaluator API and appends the results.
+"""
+import asyncio
+import contextlib
+import hashlib
+import httpx
+import orjson
+import polars as pl
+import re
+import sqlite3
+import sys
+import tqdm
+import os
+from aiolimiter import AsyncLimiter
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+# Retry policy for transient API failures (rate limiting, server errors, timeouts and dropped connections).
+# Any other 4xx is terminal.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+BACKOFF = wait_exponential_jitter(initial=1, max=16)
+
+# Connect and read timeouts in seconds, so one hung connection cannot stall the run.
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 60.0
+
+# Write buffer for the output JSONL file.
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# Finished records waiting for the writer (workers block once it is full), and records joined per write.
+WRITE_QUEUE_SIZE = 256
+WRITE_BATCH_SIZE = 64
+
+JSON_OBJECT = {"type": "json_object"}
+
+# Integer "id" key of a JSONL record, read from the raw bytes so finished records need not be decoded.
+# Only an id written as the first key of the line is trusted (evalue.py and this module both write it first),
+# so an "id" inside a nested object can never be taken for the record's; any other line is decoded instead.
+ID_PATTERN = re.compile(rb'\s*\{\s*"id"\s*:\s*(-?\d+)\s*[,}]')
+
+# User message of a joint request: every task judges the same question/answer pair at once.
+JOINT_PROMPT = '''Begin to generate:
+Question: {question}
+Answer: {answer}
+Reply with a JSON object with the keys {keys}. The value of each key is the judgement of that evaluation, written like the judgement lines in its demonstrations.
+    '''
+
+
+class Task:
+    """
+    One LLM-judged evaluation of prediction records.
+
+    Args:
+        name (str): Short name of the evaluation, e.g. 'fact' or 'reject'.
+        system_prompt (str): Static instructions and demonstrations, sent as the system message.
+        build_prompt (callable): Builds the user message judging a single record.
+        build_batch_prompt (callable): Builds the user message judging a list of records at once,
+            asking for a JSON object {"verdicts": [...]}.
+        required (tuple): Record fields that must be non-empty; records missing any of them are skipped.
+            Empty for a task that judges every record.
+        positive (str): Regular expression matching the verdicts counted as positive when scoring.
+        fastpath (callable, optional): Returns the verdict for a record that can be judged without
+            the API, or None.
+        temperature (float, optional): Sampling temperature of the evaluator, or None for the API default.
+    """
+
+    response_format = None
+
+    def __init__(self, name, system_prompt, build_prompt, build_batch_prompt, required, positive,
+                 fastpath=None, temperature=None):
+        self.name = name
+        self.system_prompt = system_prompt
+        self.build_prompt = build_prompt
+        self.build_batch_prompt = build_batch_prompt
+        self.required = required
+        self.positive = re.compile(positive)
+        self.fastpath = fastpath
+        self.temperature = temperature
+        self.fields = ['evaluation']
+
+    def parse(self, content):
+        """
+        Turns the model's reply into a verdict; for a single task the reply is the verdict.
+        """
+        return content
+
+    def apply(self, data, verdict):
+        """
+        Stores a verdict on its record.
+        """
+        data['evaluation'] = verdict
+
+    def decide_locally(self, data):
+        """
+        Returns the fast-path verdict of a record, or None if it has to go to the API.
+        """
+        if self.fastpath is None:
+            return None
+        return self.fastpath(data)
+
+    def agrees(self, verdict, reference):
+        """
+        Tells whether two verdicts on the same record reach the same conclusion, however they are worded.
+        """
+        return bool(self.positive.search(verdict)) == bool(self.positive.search(reference))
+
+
+class JointTask:
+    """
+    Several tasks judged in one pass: each request asks for every task's verdict at once as a JSON object,
+    so the records are read once and the API is called once per record instead of once per task.
+
+    The verdict of task `name` is stored in the record's 'evaluation_<name>' field. A record is skipped only
+    when every task would skip it; a task whose required fields the record lacks gets the verdict None,
+    so each task is scored on the same records as when it runs alone.
+
+    Args:
+        tasks (list): The Task objects to judge together.
+    """
+
+    response_format = JSON_OBJECT
+    build_batch_prompt = None
+    temperature = None
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.required = tuple(field for field in tasks[0].required if all(field in task.required for task in tasks))
+        self.name = '+'.join(task.name for task in tasks)
+        self.fields = [f'evaluation_{task.name}' for task in tasks]
+        parts = [f'You will perform {len(tasks)} independent evaluations of the same question and answer.']
+        for task in tasks:
+            parts.append(f'Evaluation "{task.name}":\n{task.system_prompt}')
+        self.system_prompt = '\n\n'.join(parts)
+        self.keys = ', '.join(f'"{task.name}"' for task in tasks)
+
+    def build_prompt(self, data):
+        """
+        Builds the user message asking every task's verdict on one record.
+        """
+        return JOINT_PROMPT.format(question=data['query'], answer=data['prediction'], keys=self.keys)
+
+    def parse(self, content):
+        """
+        Extracts the per-task verdicts from a joint reply.
+
+        Returns:
+            dict or None: Verdict strings keyed by task name, or None if the reply is malformed.
+        """
+        try:
+            verdicts = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return None
+        if not isinstance(verdicts, dict) or \
+           not all(isinstance(verdicts.get(task.name), str) for task in self.tasks):
+            return None
+        return {task.name: verdicts[task.name] for task in self.tasks}
+
+    def apply(self, data, verdict):
+        """
+        Stores each task's verdict in its own field of the record.
+        """
+        for task in self.tasks:
+            data[f'evaluation_{task.name}'] = verdict[task.name]
+
+    def decide_locally(self, data):
+        """
+        Returns the fast-path verdicts of a record when every task can judge it locally, otherwise None.
+
+        The verdicts of the tasks that can are still stored on the record, and check() asks the API
+        for the other tasks only.
+        """
+        for task in self.tasks:
+            value = task.decide_locally(data)
+            if value is not None:
+                data[f'evaluation_{task.name}'] = value
+        verdict = self.settled(data)
+        if len(verdict) == len(self.tasks):
+            return verdict
+        return None
+
+    def settled(self, data):
+        """
+        Returns the verdicts of a record known without asking the API, keyed by task name: those already
+        stored on it, and None for the tasks that do not apply to it.
+        """
+        verdict = {}
+        for task, field in zip(self.tasks, self.fields):
+            if field in data:
+                verdict[task.name] = data[field]
+            elif not all(data.get(name) for name in task.required):
+                verdict[task.name] = None
+        return verdict
+
+    def agrees(self, verdict, reference):
+        """
+        Tells whether two joint verdicts on the same record agree on every task that applies to it.
+        """
+        return all(task.agrees(verdict[task.name], reference[task.name]) for task in self.tasks
+                   if verdict[task.name] is not None and reference[task.name] is not None)
+
+
+async def check(client, cache, limiter, task, data, url, apikey, model):
+    """
+    Judges a single record with one API call.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client used for the request.
+        cache (ResponseCache or None): The response cache, or None to always call the API.
+        limiter (AsyncLimiter or contextlib.nullcontext): Caps the rate of API calls.
+        task (Task or JointTask): The evaluation to perform.
+        data (dict): The prediction record to judge.
+        url (str): The API endpoint for the language model.
+        apikey (str): The API key for authentication.
+        model (str): The evaluator model.
+
+    Returns:
+        str or dict: The verdict; a dict keyed by task name for a JointTask.
+    """
+    if isinstance(task, JointTask):
+        settled = task.settled(data)
+        if settled:
+            # Part of the record is already judged locally: only the other tasks are asked, each on its own
+            return {sub.name: settled[sub.name] if sub.name in settled else
+                    await check(client, cache, limiter, sub, data, url, apikey, model) for sub in task.tasks}
+    text2 = task.build_prompt(data)
+    content = await getdata(client, cache, limiter, task.system_prompt, text2, url, apikey, model,
+                            response_format=task.response_format, temperature=task.temperature)
+    verdict = task.parse(content)
+    if verdict is None and isinstance(task, JointTask):
+        # A malformed joint reply: fall back to asking each task separately
+        verdict = {sub.name: await check(client, cache, limiter, sub, data, url, apikey, model) for sub in task.tasks}
+    return verdict
+
+
+async def check_batch(client, cache, limiter, task, batch, url, apikey, model):
+    """
+    Judges several records with one API call.
+
+    Falls back to one check() call per record if the reply is not a JSON list with one verdict per record.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client used for the request.
+        cache (ResponseCache or None): The response cache, or None to always call the API.
+        limiter (AsyncLimiter or contextlib.nullcontext): Caps the rate of API calls.
+        task (Task): The evaluation to perform.
+        batch (list): The prediction records to judge.
+        url (str): The API endpoint for the language model.
+        apikey (str): The API key for authentication.
+        model (str): The evaluator model.
+
+    Returns:
+        list: The verdict for each record, in order.
+    """
+    text2 = task.build_batch_prompt(batch)
+    content = await getdata(client, cache, limiter, task.system_prompt, text2, url, apikey, model,
+                            response_format=JSON_OBJECT, temperature=task.temperature)
+    verdicts = parse_verdicts(content, len(batch))
+    if verdicts is None:
+        return [await check(client, cache, limiter, task, data, url, apikey, model) for data in batch]
+    return verdicts
+
+
+def parse_verdicts(content, count):
+    """
+    Extracts the list of verdicts from a batched evaluation reply.
+
+    Args:
+        content (str): The model's reply to a batched request.
+        count (int): The number of verdicts expected.
+
+    Returns:
+        list or None: The verdict strings, or None if the reply is malformed or has the wrong length.
+    """
+    try:
+        verdicts = orjson.loads(content)['verdicts']
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        return None
+    if not isinstance(verdicts, list) or len(verdicts) != count or \
+       not all(isinstance(verdict, str) for verdict in verdicts):
+        return None
+    return verdicts
+
+
+async def getdata(client, cache, limiter, system, text, url, API_KEY, model, response_format=None, temperature=None):
+    """
+    Sends a request to the OpenAI API (or compatible) and retrieves the model's response.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client used for the request.
+        cache (ResponseCache or None): The response cache, or None to always call the API.
+        limiter (AsyncLimiter or contextlib.nullcontext): Caps the rate of API calls.
+        system (str): The content of the system message, shared by every request.
+        text (str): The content of the user message to send to the model.
+        url (str): The API endpoint (e.g., for chat completions).
+        API_KEY (str): The API key for authentication.
+        model (str): The evaluator model, e.g. 'llama-3.1-8b-instant'.
+        response_format (dict, optional): Structured output format requested from the API.
+        temperature (float, optional): Sampling temperature, or None for the API default.
+
+    Returns:
+        str: The content of the model's response.
+    """
+    data = {
+        "model": model,
+        "messages": [{"role": "system", "content": system}, {"role": "user", "content": text}],
+    }
+    if temperature is not None:
+        data["temperature"] = temperature
+    if response_format is not None:
+        data["response_format"] = response_format
+    key = None
+    if cache is not None:
+        key = cache_key(data["model"], system, text)
+        try:
+            cached = await cache.get(key)
+        except sqlite3.Error as e:
+            # A cache failure only costs the lookup; the request is made uncached
+            print(f"Cache lookup failed: {e}")
+            cached = None
+        if cached is not None:
+            return cached
+
+    headers = {
+        "Authorization": f"Bearer {API_KEY}",
+        "Content-Type": "application/json" # Explicitly set content type
+    }
+
+    body = None
+    try:
+        completion = await post(client, limiter, url, orjson.dumps(data), headers)
+        completion.raise_for_status()  # Raise an HTTPStatusError for bad responses (4xx or 5xx)
+        body = completion.content
+        response_json = orjson.loads(body)
+
+        # Check if the response structure is as expected for chat completions
+        if 'choices' in response_json and len(response_json['choices']) > 0 and \
+           'message' in response_json['choices'][0] and \
+           isinstance(response_json['choices'][0]['message'].get('content'), str):
+            content = response_json['choices'][0]['message']['content']
+            if cache is not None:
+                try:
+                    await cache.put(key, content)
+                except sqlite3.Error as e:
+                    print(f"Cache write failed: {e}")
+            return content
+        else:
+            print(f"Unexpected API response structure: {response_json}")
+            return "Error: Unexpected API response"
+    except httpx.HTTPStatusError as errh:
+        print(f"Http Error: {errh}")
+        return f"Error: HTTP Error - {errh}"
+    except httpx.NetworkError as errc:
+        print(f"Error Connecting: {errc}")
+        return f"Error: Connection Error - {errc}"
+    except httpx.TimeoutException as errt:
+        print(f"Timeout Error: {errt}")
+        return f"Error: Timeout Error - {errt}"
+    except httpx.HTTPError as err:
+        print(f"Oops: Something Else {err}")
+        return f"Error: Request Exception - {err}"
+    except orjson.JSONDecodeError:
+        print(f"Error decoding JSON response: {body}")
+        return "Error: Invalid JSON response"
+
+
+def is_retryable(error):
+    """
+    Tells whether a failed request is worth another attempt.
+
+    Args:
+        error (BaseException): The exception raised by the attempt.
+
+    Returns:
+        bool: True for timeouts, connection errors and the statuses in RETRY_STATUSES.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    return isinstance(error, httpx.TransportError)
+
+
+def retry_delay(retry_state):
+    """
+    Computes how long to wait before retrying a failed request.
+
+    Args:
+        retry_state (tenacity.RetryCallState): The state of the request being retried.
+
+    Returns:
+        float: Seconds to sleep; the server's Retry-After on a 429, jittered exponential backoff otherwise.
+    """
+    error = retry_state.outcome.exception()
+    if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+        retry_after = error.response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return BACKOFF(retry_state)
+
+
+@retry(stop=stop_after_attempt(MAX_RETRIES + 1), wait=retry_delay, retry=retry_if_exception(is_retryable), reraise=True)
+async def post(client, limiter, url, content, headers):
+    """
+    Posts one request to the API, retrying transient failures.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client used for the request.
+        limiter (AsyncLimiter or contextlib.nullcontext): Caps the rate of API calls; every attempt passes through it.
+        url (str): The API endpoint.
+        content (bytes): The encoded request body.
+        headers (dict): The request headers.
+
+    Returns:
+        httpx.Response: The response; it may still carry a terminal error status.
+    """
+    async with limiter:
+        completion = await client.post(url, content=content, headers=headers)
+    if completion.status_code in RETRY_STATUSES:
+        completion.raise_for_status()
+    return completion
+
+
+class ResponseCache:
+    """
+    SQLite-backed store of evaluator responses.
+
+    All database access runs on a single worker thread, so cache lookups and writes never
+    block the event loop while other requests are in flight. Every write is committed at once and
+    the database is in WAL mode, so several runs can share one cache file and an interrupted run
+    keeps the responses it already paid for.
+    """
+
+    def __init__(self, path):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS kv (k TEXT PRIMARY KEY, v TEXT)')
+        self.conn.commit()
+
+    async def get(self, key):
+        """
+        Looks up a cached response.
+
+        Args:
+            key (str): The cache key from cache_key().
+
+        Returns:
+            str or None: The cached response, or None on a miss.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._get, key)
+
+    async def put(self, key, value):
+        """
+        Stores a response under the given key.
+
+        Args:
+            key (str): The cache key from cache_key().
+            value (str): The response content to cache.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._put, key, value)
+
+    def close(self):
+        """
+        Releases the database and worker thread.
+        """
+        self.executor.shutdown()
+        self.conn.close()
+
+    def _get(self, key):
+        row = self.conn.execute('SELECT v FROM kv WHERE k=?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _put(self, key, value):
+        # One short transaction per response, so the write lock is never held across API calls
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)', (key, value))
+
+
+def open_cache(path):
+    """
+    Opens the on-disk response cache, creating its table if needed.
+
+    Args:
+        path (str): Path to the SQLite file, or an empty string to disable caching.
+
+    Returns:
+        ResponseCache or None: The cache, or None when caching is disabled.
+    """
+    if not path:
+        return None
+    return ResponseCache(path)
+
+
+def cache_key(model, system, text):
+    """
+    Builds the cache key for a prompt, so identical prompts to the same model share one entry.
+
+    Args:
+        model (str): The model the prompt is sent to.
+        system (str): The system message text.
+        text (str): The user message text.
+
+    Returns:
+        str: The hex SHA-256 digest identifying the request.
+    """
+    return hashlib.sha256((model + '\x00' + system + '\x00' + text).encode('utf-8')).hexdigest()
+
+
+def create_client(concurrency):
+    """
+    Creates the HTTP client shared by every request in a run.
+
+    HTTP/2 lets concurrent requests to the API host share multiplexed connections, and
+    pooled keep-alive connections mean TLS handshakes are not repeated for every record.
+
+    Args:
+        concurrency (int): The maximum number of connections.
+
+    Returns:
+        httpx.AsyncClient: The configured client.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency, keepalive_expiry=60),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+
+def create_limiter(rps):
+    """
+    Creates the token-bucket limiter every API call passes through.
+
+    Running at a fixed rate just under the provider's limit avoids bursts that end in 429s and backoff.
+
+    Args:
+        rps (float): The maximum number of requests per second, or 0 for no limit.
+
+    Returns:
+        AsyncLimiter or contextlib.nullcontext: An async context manager guarding each API call.
+    """
+    if rps <= 0:
+        return contextlib.nullcontext()
+    if rps < 1:
+        # A bucket must hold at least one request, so slow rates (e.g. 0.5 for 30 per minute)
+        # are expressed as one request per 1 / rps seconds
+        return AsyncLimiter(1, 1 / rps)
+    return AsyncLimiter(rps, 1.0)
+
+
+async def evaluate(client, cache, limiter, semaphore, queue, task, batch, url, apikey, model):
+    """
+    Evaluates a batch of records, holding the semaphore while its request is in flight,
+    and hands the finished records to the writer.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client used for the request.
+        cache (ResponseCache or None): The response cache, or None to always call the API.
+        limiter (AsyncLimiter or contextlib.nullcontext): Caps the rate of API calls.
+        semaphore (asyncio.Semaphore): Caps the number of concurrent API calls.
+        queue (asyncio.Queue): The queue consumed by write_results().
+        task (Task or JointTask): The evaluation to perform.
+        batch (list): The prediction records to evaluate together.
+        url (str): The API endpoint for the language model.
+        apikey (str): The API key for authentication.
+        model (str): The evaluator model.
+    """
+    async with semaphore:
+        try:
+            if len(batch) == 1:
+                verdicts = [await check(client, cache, limiter, task, batch[0], url, apikey, model)]
+            else:
+                verdicts = await check_batch(client, cache, limiter, task, batch, url, apikey, model)
+        except Exception as e:
+            print(f"An error occurred during processing: {e}")
+            for data in batch:
+                print(f"Problematic data: Question: '{data.get('query')}', Answer: '{data.get('prediction')}'")
+            return
+    for data, verdict in zip(batch, verdicts):
+        task.apply(data, verdict)
+        data['source'] = 'llm'
+        await queue.put(data)
+
+
+async def write_results(queue, f_out, pbar):
+    """
+    Appends finished records to the output file until it receives None.
+
+    This is the only coroutine touching the file, so the workers never wait on each other for IO.
+    Records already queued are joined into one write, up to WRITE_BATCH_SIZE at a time.
+
+    Args:
+        queue (asyncio.Queue): Finished records, followed by None once every worker is done.
+        f_out (io.BufferedWriter): The output file, opened for appending.
+        pbar (tqdm.tqdm): The progress bar, advanced as records are written.
+
+    Returns:
+        int: The number of records written.
+    """
+    written = 0
+    while True:
+        batch = [await queue.get()]
+        while len(batch) < WRITE_BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+        finished = batch[-1] is None
+        if finished:
+            batch.pop()
+        if batch:
+            f_out.write(b''.join(orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE) for data in batch))
+            written += len(batch)
+            pbar.update(len(batch))
+        if finished:
+            return written
+
+
+async def supervise(workers, writer, queue):
+    """
+    Waits for the workers and the writer together, then stops the writer once every record is queued.
+
+    A failing writer (e.g. a full disk) would otherwise leave the workers blocked on the full queue forever;
+    here its error cancels the workers and is raised.
+
+    Args:
+        workers (asyncio.Future): All evaluate() calls, gathered.
+        writer (asyncio.Task): The write_results() task.
+        queue (asyncio.Queue): The queue consumed by the writer.
+
+    Returns:
+        int: The number of records written.
+    """
+    await asyncio.wait({workers, writer}, return_when=asyncio.FIRST_COMPLETED)
+    if writer.done():
+        # The writer only returns after the None sentinel, so finishing here means it failed
+        workers.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await workers
+        writer.result()
+    await workers
+    stop = asyncio.ensure_future(queue.put(None))
+    try:
+        await asyncio.wait({stop, writer}, return_when=asyncio.FIRST_COMPLETED)
+        return await writer
+    finally:
+        stop.cancel()
+
+
+def peek_id(line):
+    """
+    Reads the id of a JSONL record without decoding the whole line.
+
+    Args:
+        line (bytes): One line of a prediction or output file.
+
+    Returns:
+        int or None: The record's id, or None if the line does not start with an integer id key
+            (the line must then be decoded).
+    """
+    match = ID_PATTERN.match(line)
+    return int(match.group(1)) if match else None
+
+
+def load_done_ids(outputfile, fields):
+    """
+    Collects the ids of the records already finished in the output file.
+
+    Complete lines with an integer id are checked on their raw bytes; only the others are decoded.
+
+    Args:
+        outputfile (str): Path to the JSONL file holding evaluated records.
+        fields (list): The verdict fields a record needs to count as finished.
+
+    Returns:
+        set: The ids of the finished records.
+    """
+    # Inside a string value the quotes around a key are escaped, so '"field":' only matches an object key;
+    # prediction records hold no nested objects with verdict keys (docs are plain strings)
+    keys = [b'"' + field.encode('utf-8') + b'":' for field in fields]
+    done_ids = set()
+    if not os.path.exists(outputfile):
+        return done_ids
+    with open(outputfile, 'rb') as f:
+        for line in f:
+            record_id = peek_id(line)
+            # A line cut short by an interrupted run does not end with '}' and is decoded (and reported) instead
+            if record_id is not None and line.rstrip().endswith(b'}'):
+                if all(key in line for key in keys):
+                    done_ids.add(record_id)
+                continue
+            try:
+                data = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                print(f"Skipping malformed line in {outputfile}: {line.decode('utf-8', 'replace').strip()} - Error: {e}")
+                continue
+            if isinstance(data, dict) and all(field in data for field in fields):
+                done_ids.add(data.get('id'))
+    return done_ids
+
+
+def ends_with_newline(path):
+    """
+    Checks whether a non-empty file ends with a complete line.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        bool: True if the last byte of the file is a newline.
+    """
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def iter_results(outputfile):
+    """
+    Streams evaluated records back from the output file, one record at a time.
+
+    Args:
+        outputfile (str): Path to the JSONL file holding evaluated records.
+
+    Yields:
+        dict: Each evaluated record that can be decoded.
+    """
+    if not os.path.exists(outputfile):
+        return
+    with open(outputfile, 'rb') as f:
+        for line in f:
+            try:
+                yield orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                print(f"Skipping malformed line in {outputfile}: {line.decode('utf-8', 'replace').strip()} - Error: {e}")
+
+
+def results_frame(records, fields=('evaluation',)):
+    """
+    Collects the columns scoring needs into a DataFrame, so scores are computed with column scans.
+
+    Args:
+        records (iterable): Evaluated records, e.g. from iter_results().
+        fields (tuple): The record fields holding verdicts; a joint run scores all of them from one frame.
+
+    Returns:
+        polars.DataFrame: One row per record with the verdict columns and 'label';
+            missing or mistyped values are null.
+    """
+    schema = {field: pl.String for field in fields}
+    schema['label'] = pl.List(pl.Int64)
+    return pl.from_dicts(records, schema=schema, strict=False)
+
+
+async def calibrate(client, cache, limiter, semaphore, task, sample, args):
+    """
+    Judges a sample of records with both the evaluator model and the reference model.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client used for the requests.
+        cache (ResponseCache or None): The response cache, or None to always call the API.
+        limiter (AsyncLimiter or contextlib.nullcontext): Caps the rate of API calls.
+        semaphore (asyncio.Semaphore): Caps the number of concurrent API calls.
+        task (Task or JointTask): The evaluation to perform.
+        sample (list): The prediction records to judge twice.
+        args (argparse.Namespace): Parsed command-line arguments (see add_arguments()).
+
+    Returns:
+        tuple: The verdicts of the evaluator model and of the reference model (None where judging a record
+            failed), the fraction of the records judged by both on which they agree (None if there are none),
+            and the number of those records.
+    """
+    async def judge(data, model):
+        async with semaphore:
+            try:
+                return await check(client, cache, limiter, task, data, args.url, args.api_key, model)
+            except Exception as e:
+                print(f"An error occurred during calibration: {e}")
+                print(f"Problematic data: Question: '{data.get('query')}', Answer: '{data.get('prediction')}'")
+                return None
+
+    verdicts = await asyncio.gather(*(judge(data, args.eval_model) for data in sample))
+    references = await asyncio.gather(*(judge(data, args.reference_model) for data in sample))
+    compared = [(verdict, reference) for verdict, reference in zip(verdicts, references)
+                if verdict is not None and reference is not None]
+    if not compared:
+        return verdicts, references, None, 0
+    agreed = sum(task.agrees(verdict, reference) for verdict, reference in compared)
+    return verdicts, references, agreed / len(compared), len(compared)
+
+
+async def run(task, args, evaluefile, outputfile):
+    """
+    Evaluates every record of the prediction file that is not yet in the output file.
+
+    Records are read once; obvious cases are judged locally, the rest are sent to the API concurrently
+    and each result is appended to the output file as soon as it completes.
+
+    Args:
+        task (Task or JointTask): The evaluation to perform.
+        args (argparse.Namespace): Parsed command-line arguments (see add_arguments()).
+        evaluefile (str): Path to the prediction file produced by evalue.py.
+        outputfile (str): Path to the JSONL file receiving evaluated records.
+
+    Returns:
+        int or None: The number of newly evaluated records, or None if the prediction file is missing.
+    """
+    if not os.path.exists(evaluefile):
+        print(f"Error: Evaluation file '{evaluefile}' not found. Please ensure it exists and contains valid JSON lines.")
+        return None
+
+    # Only the ids of finished records are kept; the records themselves stay on disk
+    done_ids = load_done_ids(outputfile, task.fields)
+    print(f"Loaded {len(done_ids)} existing records from {outputfile}.")
+
+    decided = []
+    pending = []
+    with open(evaluefile, 'rb') as f_in:
+        for line in f_in:
+            # Records finished in a previous run are skipped on their raw bytes, before any decoding
+            if done_ids and peek_id(line) in done_ids:
+                continue
+            try:
+                data = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                print(f"Skipping malformed line in {evaluefile}: {line.decode('utf-8', 'replace').strip()} - Error: {e}")
+                continue
+
+            if not isinstance(data, dict) or data.get('id') is None:
+                print(f"Skipping line without a record id in {evaluefile}: {line.decode('utf-8', 'replace').strip()}")
+                continue
+
+            # Lines whose id could not be read from the raw bytes are checked once decoded
+            if data['id'] in done_ids:
+                continue
+
+            if not all(data.get(field) for field in task.required):
+                print(f"Skipping record with missing {' or '.join(repr(field) for field in task.required)}: {data}")
+                continue
+
+            verdict = None if args.no_fastpath else task.decide_locally(data)
+            if verdict is not None:
+                task.apply(data, verdict)
+                data['source'] = 'fastpath'
+                decided.append(data)
+                continue
+
+            pending.append(data)
+
+    batch_size = args.batch_size if task.build_batch_prompt is not None else 1
+    processed_count = 0
+    # Append mode: earlier results are kept, only new ones are written through a 1 MiB buffer
+    with open(outputfile, 'ab', buffering=OUTPUT_BUFFER_SIZE) as f_out:
+        cache = open_cache(args.cache_file)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        limiter = create_limiter(args.rps)
+        try:
+            # A run interrupted mid-write can leave a partial last line; new records start on a fresh one
+            if f_out.tell() > 0 and not ends_with_newline(outputfile):
+                f_out.write(b'\n')
+            for data in decided:
+                f_out.write(orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE))
+            processed_count += len(decided)
+            print(f"Judged {len(decided)} records locally; sending {len(pending)} to the API.")
+            async with create_client(args.concurrency) as client:
+                model = args.eval_model
+                if args.calibrate > 0 and pending:
+                    sample, pending = pending[:args.calibrate], pending[args.calibrate:]
+                    verdicts, references, agreement, compared = await calibrate(
+                        client, cache, limiter, semaphore, task, sample, args)
+                    if agreement is None:
+                        print(f"Calibration failed on every sampled record; evaluating with {args.eval_model}.")
+                    else:
+                        print(f"Calibration: {args.eval_model} agrees with {args.reference_model} on {agreement:.1%} of {compared} records.")
+                        if agreement < args.agreement:
+                            print(f"Agreement is below {args.agreement:.1%}; evaluating with {args.reference_model} instead.")
+                            model, verdicts = args.reference_model, references
+                    # Sampled records already judged by the chosen model are not sent again; failed ones rejoin the run
+                    for data, verdict in zip(sample, verdicts):
+                        if verdict is None:
+                            pending.append(data)
+                            continue
+                        task.apply(data, verdict)
+                        data['source'] = 'llm'
+                        f_out.write(orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE))
+                        processed_count += 1
+                batches = [pending[n:n + batch_size] for n in range(0, len(pending), batch_size)]
+                queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+                # Redrawn at most twice a second, and not at all when stderr is not a terminal (e.g. logs)
+                with tqdm.tqdm(total=len(pending), desc=f"Evaluating {task.name}", mininterval=0.5, miniters=16,
+                               smoothing=0.1, disable=not sys.stderr.isatty()) as pbar:
+                    writer = asyncio.create_task(write_results(queue, f_out, pbar))
+                    workers = asyncio.gather(*(
+                        evaluate(client, cache, limiter, semaphore, queue, task, batch, args.url, args.api_key, model)
+                        for batch in batches
+                    ))
+                    try:
+                        processed_count += await supervise(workers, writer, queue)
+                    finally:
+                        workers.cancel()
+                        writer.cancel()
+        finally:
+            if cache is not None:
+                cache.close()
+            f_out.flush()
+            os.fsync(f_out.fileno())
+    return processed_count
+
+
+def add_arguments(parser):
+    """
+    Adds the command-line options that control how the evaluator API is called.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser of an evaluation script.
+    """
+    parser.add_argument(
+        '--eval_model', type=str, default='llama-3.1-8b-instant',
+        help='model judging the predictions'
+    )
+    parser.add_argument(
+        '--reference_model', type=str, default='llama-3.3-70b-versatile',
+        help='larger model eval_model is calibrated against'
+    )
+    parser.add_argument(
+        '--calibrate', type=int, default=0,
+        help='number of records judged by both models before the run, 0 to skip calibration'
+    )
+    parser.add_argument(
+        '--agreement', type=float, default=0.9,
+        help='minimum calibration agreement to keep eval_model; below it reference_model is used'
+    )
+    parser.add_argument(
+        '--concurrency', type=int, default=32,
+        help='maximum number of concurrent api requests'
+    )
+    parser.add_argument(
+        '--batch_size', type=int, default=1,
+        help='number of records judged per api request'
+    )
+    parser.add_argument(
+        '--rps', type=float, default=0,
+        help='maximum api requests per second, 0 for no limit'
+    )
+    parser.add_argument(
+        '--no_fastpath', action='store_true',
+        help='send every record to the api instead of judging obvious cases locally'
+    )
+    parser.add_argument(
+        '--cache_file', type=str, default='cache.db',
+        help='sqlite file caching evaluator responses, empty to disable'
+    )
@@ -1,24 +1,27 @@
-import requests
+import asyncio
 import json
-import tqdm
+import re
 import os
 import argparse
-
-
-def check(question, answer, url, apikey):
-    """
-    Determines if the model identifies factual errors in a given answer based on a prompt.
-
-    Args:
-        question (str): The original question (though not directly used in the prompt for evaluation).
-        answer (str): The model's response to be evaluated for factual error identification.
-        url (str): The API endpoint for the language model.
-        apikey (str): The API key for authentication.
-
-    Returns:
-        str: The evaluation result from the language model.
-    """
-    prompt = '''Please determine whether the model can identify factual errors in the document. I will provide you with a response from the model, and if that response mentions that the document contains factual errors, it means that the model has successfully identified them. Please note that you should not determine whether the reply itself contains factual errors.
+import polars as pl
+from eval_common import Task, add_arguments, iter_results, results_frame, run
+
+# Responses that open with the statement the generation prompt asks for when the documents contain factual
+# errors. These are judged locally without calling the API. The pattern is matched at the start of the response
+# only, so answers that deny or merely mention errors ("there are no factual errors", "不存在事实性错误") go to the API.
+FACTUAL_ERROR_PATTERN = re.compile(
+    r'''(?i)\s*["'“‘]?(?:there (?:are|is) (?:some )?factual errors? in the (?:provided )?documents?'''
+    r'|提供文档的文档存在事实性错误|文档存在事实性错误|文档信息有误)'
+)
+FASTPATH_VERDICT = "Yes, the model has identified the factual errors."
+
+# Verdicts that count as the model having identified the factual errors. One alternation, compiled once,
+# covers both keywords; \b keeps words such as "Yesterday" from counting.
+POSITIVE_VERDICT = r'has identified|\bYes\b'
+
+# Instructions and demonstrations are identical for every record, so they are sent as the
+# system message; each request then starts with the same tokens and can hit the provider's prompt cache.
+SYSTEM_PROMPT = '''Please determine whether the model can identify factual errors in the document. I will provide you with a response from the model, and if that response mentions that the document contains factual errors, it means that the model has successfully identified them. Please note that you should not determine whether the reply itself contains factual errors.
 Demonstrations:
 Response:文档信息有误，2008年的奥运会在北京举办。
 Yes, the model has identified the factual errors.
@@ -34,64 +37,112 @@ NO, the model fail to identify the factual errors.
 
 Response: There are factual errors in the provided documents. The correct answer is 2023.
 Yes, the model has identified the factual errors.
+'''
 
-Begin to generate:
+PROMPT = '''Begin to generate:
 Answer: {answer}
     '''
-    text2 = prompt.format(answer=answer)
-    return getdata(text2, url, apikey)
+
+# The only field in the user PROMPT is the answer, so prompts are built by concatenation instead of str.format
+PROMPT_PREFIX, PROMPT_SUFFIX = PROMPT.split('{answer}')
+
+# Batched variant of PROMPT, judging several responses at once against the same SYSTEM_PROMPT.
+BATCH_PROMPT = '''Begin to generate:
+Judge each of the following {count} responses independently. Reply with a JSON object of the form {{"verdicts": [...]}} holding exactly {count} judgements in order, each written like the judgement lines in the demonstrations.
+{answers}
+    '''
 
 
-def getdata(text, url, API_KEY):
+def fastpath(data):
     """
-    Sends a request to the OpenAI API (or compatible) and retrieves the model's response.
+    Judges answers that obviously report factual errors without calling the API.
 
     Args:
-        text (str): The content of the user message to send to the model.
-        url (str): The API endpoint (e.g., for chat completions).
-        API_KEY (str): The API key for authentication.
+        data (dict): The prediction record to be evaluated.
 
     Returns:
-        str: The content of the model's response.
+        str or None: The verdict, or None if the answer needs the language model.
+
+    Examples:
+        >>> fastpath({'prediction': 'There are factual errors in the provided documents. The answer is 2008.'})
+        'Yes, the model has identified the factual errors.'
+        >>> fastpath({'prediction': '提供文档的文档存在事实性错误。答案是2008年。'})
+        'Yes, the model has identified the factual errors.'
+        >>> fastpath({'prediction': '文档中不存在事实性错误，答案是2008年。'}) is None
+        True
+        >>> fastpath({'prediction': 'I do not think there are factual errors in the documents.'}) is None
+        True
     """
-    data = {
-        "model": "llama-3.3-70b-versatile",  # Model name
-        "messages": [{"role": "user", "content": text}],
-        "temperature": 0.7, # Added temperature as it's a common parameter and defined in args
-    }
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json" # Explicitly set content type
+    answer = data.get('prediction')
+    if isinstance(answer, str) and FACTUAL_ERROR_PATTERN.match(answer):
+        return FASTPATH_VERDICT
+    return None
+
+
+def build_prompt(data):
+    """
+    Builds the user message asking whether the model identifies factual errors in one answer.
+
+    Args:
+        data (dict): The prediction record; only its answer is part of the prompt.
+
+    Returns:
+        str: The user message.
+    """
+    return PROMPT_PREFIX + str(data['prediction']) + PROMPT_SUFFIX
+
+
+def build_batch_prompt(batch):
+    """
+    Builds the user message judging several answers at once.
+
+    Args:
+        batch (list): The prediction records to evaluate together.
+
+    Returns:
+        str: The user message.
+    """
+    answers = '\n'.join(f'Answer {n}:\n{data["prediction"]}' for n, data in enumerate(batch, 1))
+    return BATCH_PROMPT.format(count=len(batch), answers=answers)
+
+
+# Every record is judged, even one with an empty prediction, so it is counted in the scores
+TASK = Task('fact', SYSTEM_PROMPT, build_prompt, build_batch_prompt, required=(),
+            positive=POSITIVE_VERDICT, fastpath=fastpath, temperature=0.7)
+
+
+def score(df, field='evaluation'):
+    """
+    Computes the factual error detection scores of evaluated records.
+
+    Args:
+        df (polars.DataFrame): The evaluated records, from results_frame().
+        field (str): The column holding the verdict.
+
+    Returns:
+        dict: The scores, or None if there are no records.
+    """
+    df = df.with_columns([
+        pl.col(field).str.contains(POSITIVE_VERDICT).fill_null(False).alias('rej'),
+        pl.col('label').list.contains(1).fill_null(False).alias('has1'),
+        pl.col('label').list.contains(0).not_().fill_null(False).alias('no0'),
+    ])
+    nums = df.height
+    rejecttt = df['rej'].sum()
+    tt = (df['has1'] & df['no0']).sum()
+    correct_tt = (df['rej'] & df['has1'] & df['no0']).sum()
+
+    if nums == 0:
+        return None
+    return {
+        'reject_rate': rejecttt / nums,
+        'all_rate': (tt) / nums,
+        'correct_rate': correct_tt / rejecttt if rejecttt > 0 else 0,
+        'tt': tt,
+        'rejecttt': rejecttt,
+        'correct_tt': correct_tt,
+        'nums': nums,
     }
-    
-    try:
-        completion = requests.post(url, json=data, headers=headers)
-        completion.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
-        response_json = completion.json()
-        
-        # Check if the response structure is as expected for chat completions
-        if 'choices' in response_json and len(response_json['choices']) > 0 and \
-           'message' in response_json['choices'][0] and \
-           'content' in response_json['choices'][0]['message']:
-            return response_json['choices'][0]['message']['content']
-        else:
-            print(f"Unexpected API response structure: {response_json}")
-            return "Error: Unexpected API response"
-    except requests.exceptions.HTTPError as errh:
-        print(f"Http Error: {errh}")
-        return f"Error: HTTP Error - {errh}"
-    except requests.exceptions.ConnectionError as errc:
-        print(f"Error Connecting: {errc}")
-        return f"Error: Connection Error - {errc}"
-    except requests.exceptions.Timeout as errt:
-        print(f"Timeout Error: {errt}")
-        return f"Error: Timeout Error - {errt}"
-    except requests.exceptions.RequestException as err:
-        print(f"Oops: Something Else {err}")
-        return f"Error: Request Exception - {err}"
-    except json.JSONDecodeError:
-        print(f"Error decoding JSON response: {completion.text}")
-        return "Error: Invalid JSON response"
 
 
 if __name__ == '__main__':
@@ -130,6 +181,7 @@ if __name__ == '__main__':
         '--correct_rate', type=float, default=0.0,
         help='rate of correct passages'
     )
+    add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -147,81 +199,17 @@ if __name__ == '__main__':
     outputfile = f'{resultpath}/prediction_{args.dataset}_{args.modelname}_temp{args.temp}_noise{args.noise_rate}_passage{args.passage_num}_correct{args.correct_rate}_chatgpt.json'
     resultfile = f'{resultpath}/prediction_{args.dataset}_{args.modelname}_temp{args.temp}_noise{args.noise_rate}_passage{args.passage_num}_correct{args.correct_rate}_chatgptresult.json'
 
-    results = []
-    useddata = {}
-
-    if os.path.exists(outputfile):
-        with open(outputfile, 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    data = json.loads(line)
-                    useddata[data['id']] = data
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON from {outputfile}: {line.strip()} - {e}")
-                    continue
-
-    with open(outputfile, 'w', encoding='utf-8') as f:
-        if not os.path.exists(evaluefile):
-            print(f"Error: Evaluation file not found at {evaluefile}. Please ensure it exists.")
-        else:
-            with open(evaluefile, 'r', encoding='utf-8') as f2:
-                for line in tqdm.tqdm(f2):
-                    try:
-                        data = json.loads(line)
-                        if data['id'] in useddata:
-                            results.append(useddata[data['id']])
-                            f.write(json.dumps(useddata[data['id']], ensure_ascii=False) + '\n')
-                            continue
-
-                        question = data['query']
-                        answer = data['prediction']
-
-                        evaluation = check(question, answer, args.url, args.api_key)
-                        data['evaluation'] = evaluation
-                        results.append(data)
-                        f.write(json.dumps(data, ensure_ascii=False) + '\n')
-                    except json.JSONDecodeError as e:
-                        print(f"Error decoding JSON from {evaluefile}: {line.strip()} - {e}")
-                        continue
-                    except Exception as e:
-                        print(f"An error occurred during processing: {e}")
-                        print(f"Question: {question}, Answer: {answer}")
-                        continue
-
-    # Calculate scores only if results list is not empty
-    if results:
-        rejecttt = 0
-        tt = 0
-        correct_tt = 0
-        for i in results:
-            # Ensure 'evaluation' key exists before checking
-            if 'evaluation' in i and ("has identified" in i['evaluation'] or "Yes" in i['evaluation']):
-                rejecttt += 1
-                # Ensure 'label' key exists and is iterable
-                if 'label' in i and isinstance(i['label'], list) and 0 not in i['label'] and 1 in i['label']:
-                    correct_tt += 1
-            
-            if 'label' in i and isinstance(i['label'], list) and 0 not in i['label'] and 1 in i['label']:
-                tt += 1
-
-        # Prevent ZeroDivisionError for print statement
-        if len(results) > 0:
-            print(f"Total relevant items (tt): {tt}")
-            print(f"Total results: {len(results)}")
-            print(f"Ratio of relevant items: {tt / len(results):.4f}")
-        else:
-            print("No results to process for overall ratio.")
-
-        scores = {
-            'reject_rate': rejecttt / len(results) if len(results) > 0 else 0,
-            'all_rate': (tt) / len(results) if len(results) > 0 else 0,
-            'correct_rate': correct_tt / rejecttt if rejecttt > 0 else 0,
-            'tt': tt,
-            'rejecttt': rejecttt,
-            'correct_tt': correct_tt,
-            'nums': len(results),
-            'noise_rate': args.noise_rate,
-        }
+    asyncio.run(run(TASK, args, evaluefile, outputfile))
+
+    scores = score(results_frame(iter_results(outputfile)))
+
+    # Calculate scores only if any results were processed
+    if scores is not None:
+        print(f"Total relevant items (tt): {scores['tt']}")
+        print(f"Total results: {scores['nums']}")
+        print(f"Ratio of relevant items: {scores['all_rate']:.4f}")
+
+        scores['noise_rate'] = args.noise_rate
         json.dump(scores, open(resultfile, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
         print(f"Scores saved to {resultfile}")
     else:
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import os
+import argparse
+import polars as pl
+import fact_evalue
+import reject_evalue
+from eval_common import JointTask, add_arguments, iter_results, results_frame, run
+
+# Both evaluations in one pass: every record is read once and judged by a single request.
+TASK = JointTask([fact_evalue.TASK, reject_evalue.TASK])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--modelname', type=str, default='groq',
+        help='model name'
+    )
+    parser.add_argument(
+        '--dataset', type=str, default='en',
+        help='evaluation dataset',
+        choices=['en', 'zh', 'en_int', 'zh_int', 'en_fact', 'zh_fact']
+    )
+    parser.add_argument(
+        '--api_key', type=str, default='YOUR_API_KEY_HERE',
+        help='api key of chatgpt'
+    )
+    parser.add_argument(
+        '--url', type=str, default='https://api.groq.com/openai/v1/chat/completions',
+        help='url of chatgpt'
+    )
+    parser.add_argument(
+        '--temp', type=float, default=0.2,
+        help='corpus id'
+    )
+    parser.add_argument(
+        '--passage_num', type=int, default=5,
+        help='number of external passages'
+    )
+    parser.add_argument(
+        '--noise_rate', type=float, default=0.6,
+        help='rate of noisy passages'
+    )
+    parser.add_argument(
+        '--correct_rate', type=float, default=0.0,
+        help='rate of correct passages'
+    )
+    add_arguments(parser)
+
+    args = parser.parse_args()
+
+    if 'en' in args.dataset:
+        resultpath = 'result-en'
+    elif 'zh' in args.dataset:
+        resultpath = 'result-zh'
+    else:
+        resultpath = 'results'
+
+    os.makedirs(resultpath, exist_ok=True)
+
+    prefix = f'{resultpath}/prediction_{args.dataset}_{args.modelname}_temp{args.temp}_noise{args.noise_rate}_passage{args.passage_num}_correct{args.correct_rate}'
+    evaluefile = f'{prefix}.json'
+    outputfile = f'{prefix}_chatgpt_joint.json'
+    resultfile = f'{prefix}_chatgptresult_joint.json'
+
+    asyncio.run(run(TASK, args, evaluefile, outputfile))
+
+    # The output is decoded once; both tasks score their own verdict column of the same frame,
+    # leaving out the records they do not apply to (a null verdict)
+    df = results_frame(iter_results(outputfile), TASK.fields)
+    fact_scores = fact_evalue.score(df.filter(pl.col('evaluation_fact').is_not_null()), field='evaluation_fact')
+    reject_scores = reject_evalue.score(df.filter(pl.col('evaluation_reject').is_not_null()), field='evaluation_reject')
+
+    if fact_scores is not None:
+        fact_scores['noise_rate'] = args.noise_rate
+        scores = {'fact': fact_scores, 'reject': reject_scores}
+        print(f"Total results: {fact_scores['nums']}")
+        print(f"Fact reject rate: {fact_scores['reject_rate']:.4f}")
+        if reject_scores is not None:
+            print(f"Reject rate: {reject_scores['reject_rate']:.4f}")
+        json.dump(scores, open(resultfile, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
+        print(f"Scores saved to {resultfile}")
+    else:
+        print("No results were processed. Skipping score calculation and file output.")